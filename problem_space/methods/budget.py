@@ -0,0 +1,70 @@
+import time
+import typing
+
+
+class Budget:
+    """
+    Token and wall-clock limits of a single attempt. The clock starts when the budget is created.
+
+    Completion tokens are counted per streamed chunk while generating and replaced with the exact
+    `eval_count` reported by ollama once a response is done. Tokens of the problem-space distance
+    evaluator are reported by its server and count against the same limit.
+
+    Both limits are soft: they are checked between streamed chunks and before every tool call,
+    so a stalled stream or a slow tool call (e.g. a distance evaluation) may overrun `max_seconds`.
+    """
+
+    def __init__(self, max_tokens: int | None = None, max_seconds: float | None = None):
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.pending_tokens = 0
+        self.evaluator_prompt_tokens = 0
+        self.evaluator_completion_tokens = 0
+        self.started_at = time.monotonic()
+
+    @property
+    def tokens(self) -> int:
+        return (
+            self.prompt_tokens + self.completion_tokens + self.pending_tokens
+            + self.evaluator_prompt_tokens + self.evaluator_completion_tokens
+        )
+
+    @property
+    def seconds(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def add_chunk(self, part: typing.Any) -> None:
+        if getattr(part, 'done', False):
+            self.prompt_tokens += getattr(part, 'prompt_eval_count', None) or 0
+            self.completion_tokens += getattr(part, 'eval_count', None) or self.pending_tokens
+            self.pending_tokens = 0
+        else:
+            self.pending_tokens += 1
+
+    def set_evaluator_usage(self, prompt_tokens: int, completion_tokens: int) -> None:
+        """
+        Totals reported by the distance evaluator since the attempt started.
+        """
+        self.evaluator_prompt_tokens = prompt_tokens
+        self.evaluator_completion_tokens = completion_tokens
+
+    def is_exhausted(self) -> bool:
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return True
+        if self.max_seconds is not None and self.seconds >= self.max_seconds:
+            return True
+        return False
+
+    def to_dict(self) -> dict[str, typing.Any]:
+        return {
+            'max_tokens': self.max_tokens,
+            'max_seconds': self.max_seconds,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens + self.pending_tokens,
+            'evaluator_prompt_tokens': self.evaluator_prompt_tokens,
+            'evaluator_completion_tokens': self.evaluator_completion_tokens,
+            'seconds': round(self.seconds, 3),
+            'exhausted': self.is_exhausted(),
+        }
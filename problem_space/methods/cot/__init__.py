@@ -2,6 +2,7 @@ import re
 
 import ollama
 
+from problem_space.methods.budget import Budget
 from problem_space.tasks import game24
 
 
@@ -17,6 +18,7 @@ async def run(
     max_iter: int = 200,
     model: str = 'cogito:14b',
     temperature: float = 0.7,
+    budget: Budget | None = None,
 ) -> tuple[str, list[dict[str, str]]]:
     answer = "no answer"
     messages = [
@@ -37,12 +39,14 @@ async def run(
             },
             stream=True,
         ):
+            if budget is not None:
+                budget.add_chunk(part)
             if not part.message.content:
                 break
 
             response_text += part.message.content or ''
             print(part.message.content, end='', flush=True)
-            if len(response_text) > 30000:
+            if len(response_text) > 30000 or (budget is not None and budget.is_exhausted()):
                 response_text += "<interrupted>"
                 break
 
@@ -56,6 +60,9 @@ async def run(
             answer = matches[-1]
             break
 
+        if budget is not None and budget.is_exhausted():
+            break
+
         messages.append({'role': 'user', 'content': 'continue reasoning'})
         print(messages[-1])
 
@@ -5,6 +5,7 @@ import fastmcp
 import mcp
 import ollama
 
+from problem_space.methods.budget import Budget
 from problem_space.tasks import game24
 
 
@@ -20,6 +21,18 @@ INSTRUCTIONS_PROMPT = """INSTRUCTIONS:
 * When the tool provides a result use it to answer the question, do not ignore the result.
 """
 
+# tools used by the experiment harness, not shown to the solver
+INTERNAL_TOOLS = ('problem_space_get_evaluator_usage',)
+
+
+async def update_evaluator_usage(client: fastmcp.Client, budget: Budget) -> None:
+    output = await client.call_tool("problem_space_get_evaluator_usage", {})
+    if not output or not isinstance(output[0], mcp.types.TextContent):
+        raise ValueError(f'cannot parse tool response: {str(output)}')
+
+    usage = json.loads(output[0].text)
+    budget.set_evaluator_usage(usage['prompt_tokens'], usage['completion_tokens'])
+
 
 async def run(
     client: fastmcp.Client,
@@ -28,11 +41,14 @@ async def run(
     model: str = 'cogito:14b',
     temperature: float = 0.7,
     seed: int = 0,
+    budget: Budget | None = None,
 ) -> tuple[str, list[dict[str, str]]]:
     available_tools = []
 
     res = await client.list_tools_mcp()
     for tool in res.tools:
+        if tool.name in INTERNAL_TOOLS:
+            continue
         available_tools.append(ollama.Tool.model_validate({
             'type': 'function',
             'function': {
@@ -69,6 +85,8 @@ async def run(
             },
             stream=True,
         ):
+            if budget is not None:
+                budget.add_chunk(part)
             if part.message.content is None and not part.message.tool_calls:
                 break
 
@@ -78,7 +96,7 @@ async def run(
                 print(json.dumps([tool.model_dump() for tool in part.message.tool_calls]), end='', flush=True)
                 tool_calls.extend(part.message.tool_calls)
 
-            if len(response_text) > 32000 or len(tool_calls) > 100:
+            if len(response_text) > 32000 or len(tool_calls) > 100 or (budget is not None and budget.is_exhausted()):
                 response_text += "<interrupted>"
                 break
 
@@ -94,6 +112,9 @@ async def run(
                 answer = matches[-1]
                 break
 
+            if budget is not None and budget.is_exhausted():
+                break
+
             # matches = re.findall(r'<more\/>', response_text, re.DOTALL)
             # if len(matches) > 0:
             #     continue
@@ -110,6 +131,12 @@ async def run(
 
         any_tool_failed = False
         for tool in tool_calls:
+            # remaining calls could each cost a distance evaluation
+            if budget is not None and budget.is_exhausted():
+                messages.append({'role': 'tool', 'content': "<interrupted>", 'name': tool.function.name})
+                print(messages[-1])
+                continue
+
             try:
                 output = await client.call_tool(tool.function.name, dict(tool.function.arguments))
                 if output and not isinstance(output[0], mcp.types.TextContent):
@@ -126,10 +153,16 @@ async def run(
                 messages.append({'role': 'tool', 'content': f"{tool.function.name}: {str(e)}", 'name': tool.function.name})
                 print(messages[-1])
 
+            if budget is not None and tool.function.name.startswith('problem_space_'):
+                await update_evaluator_usage(client, budget)
+
         if any_tool_failed:
             messages.append({'role': 'user', 'content': "one of tool calls failed"})
             print(messages[-1])
 
+        if budget is not None and budget.is_exhausted():
+            break
+
         # messages.append({'role': 'system', 'content': 'continue, use tool responses'})
         # print(messages[-1])
 
@@ -143,6 +176,9 @@ async def run(
         'name': "problem_space_get_insight",
     })
 
+    if budget is not None:
+        await update_evaluator_usage(client, budget)
+
         #if any_tool_failed:
         #    messages.append({'role': 'user', 'content': "fix TOOL CALL FAILED. Don't call `reset_problem_space`, focus on initial problem"})
         #    print(messages[-1])
@@ -0,0 +1,252 @@
+import bisect
+import collections.abc as cabc
+import contextlib
+import functools
+import http.server
+import threading
+import time
+import typing
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames: tuple[str, ...], labelvalues: tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def collect(self) -> dict[tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> cabc.Iterator[str]:
+        for key, value in self.collect().items():
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {value}'
+
+    def stats(self) -> typing.Any:
+        return {','.join(key) or 'total': value for key, value in self.collect().items()}
+
+
+class Gauge(Counter):
+    """
+    Gauge which reads its values from `callback` at collection time, so hot paths pay nothing for it.
+    """
+    type = 'gauge'
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        callback: cabc.Callable[[], dict[tuple[str, ...], float]],
+        labelnames: tuple[str, ...] = (),
+    ):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+
+    def collect(self) -> dict[tuple[str, ...], float]:
+        try:
+            return self.callback()
+        except Exception:
+            return {}
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # per label set: counts per bucket (last one is +Inf), sum
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[i] += 1
+            total[0] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> cabc.Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self) -> dict[tuple[str, ...], tuple[list[int], float]]:
+        with self._lock:
+            return {key: (list(counts), total[0]) for key, (counts, total) in self._values.items()}
+
+    def render(self) -> cabc.Iterator[str]:
+        for key, (counts, total) in self.collect().items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}'
+
+    def stats(self) -> typing.Any:
+        result = {}
+        for key, (counts, total) in self.collect().items():
+            count = sum(counts)
+            result[','.join(key) or 'total'] = {
+                'count': count,
+                'sum': total,
+                'mean': total / count if count else 0.0,
+            }
+        return result
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: dict[str, Counter | Histogram] = {}
+
+    def _register(self, metric: Counter | Histogram) -> typing.Any:
+        if metric.name in self.metrics:
+            return self.metrics[metric.name]
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        callback: cabc.Callable[[], dict[tuple[str, ...], float]],
+        labelnames: tuple[str, ...] = (),
+    ) -> Gauge:
+        return self._register(Gauge(name, help, callback, labelnames))
+
+    def render(self) -> str:
+        """
+        RETURNS: metrics in Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def stats(self) -> dict[str, typing.Any]:
+        return {name: metric.stats() for name, metric in self.metrics.items()}
+
+
+METRICS = MetricsRegistry()
+
+TOOL_CALLS = METRICS.counter('mcp_tool_calls_total', 'Number of MCP tool calls', ('tool',))
+TOOL_ERRORS = METRICS.counter('mcp_tool_errors_total', 'Number of MCP tool calls which raised', ('tool', 'error'))
+TOOL_LATENCY = METRICS.histogram('mcp_tool_latency_seconds', 'MCP tool call latency', ('tool',))
+
+
+def instrument(fn: cabc.Callable) -> cabc.Callable:
+    """
+    Counts calls, errors and latency of an MCP tool. Apply below `@mcp.tool()`.
+    """
+    tool = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        TOOL_CALLS.inc(tool=tool)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            TOOL_ERRORS.inc(tool=tool, error=type(e).__name__)
+            raise
+        finally:
+            TOOL_LATENCY.observe(time.perf_counter() - start, tool=tool)
+
+    return wrapper
+
+
+def get_server_stats() -> dict[str, typing.Any]:
+    """
+    Server statistics: tool call and error counts, latencies, distance cache hits and map sizes.
+    """
+    return METRICS.stats()
+
+
+def enable(mcp: typing.Any, port: int | None = None) -> None:
+    """
+    Registers the `get_server_stats` tool on `mcp` and serves `/metrics` on `port`.
+    Off by default, so the tool set seen by solvers stays the same as in earlier experiments.
+    """
+    mcp.tool()(get_server_stats)
+    if port is not None:
+        serve(port)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    registry: MetricsRegistry = METRICS
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # stdout of MCP servers is the protocol stream
+        pass
+
+
+def serve(port: int, host: str = '127.0.0.1', registry: MetricsRegistry = METRICS) -> http.server.ThreadingHTTPServer:
+    """
+    Starts a Prometheus-text `/metrics` HTTP endpoint in a daemon thread.
+    """
+    handler = type('Handler', (_Handler,), {'registry': registry})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
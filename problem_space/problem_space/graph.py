@@ -0,0 +1,139 @@
+import collections
+import collections.abc as cabc
+import typing
+
+import graphviz
+
+from . import models
+
+
+INSIGHT_TOOL_NAMES = ('get_insight', 'problem_space_get_insight')
+
+
+def iter_maps(records: cabc.Iterable[cabc.Mapping]) -> cabc.Iterator[tuple[cabc.Mapping, models.ProblemSpaceMap]]:
+    """
+    Streams problem-space maps out of `run_experiment` records.
+    For every record the map is taken from the last `get_insight` tool message in its `chat`.
+    Records without a map (e.g. `cot` ones) are skipped.
+    """
+    for record in records:
+        m = find_map(record.get('chat') or [])
+        if m is not None:
+            yield record, m
+
+
+def find_map(chat: list[dict]) -> models.ProblemSpaceMap | None:
+    for message in reversed(chat):
+        if message.get('role') != 'tool' or message.get('name') not in INSIGHT_TOOL_NAMES:
+            continue
+        try:
+            return models.ProblemSpaceMap.model_validate_json(message.get('content') or '')
+        except ValueError:
+            # the tool failed, e.g. goal was never set
+            return None
+    return None
+
+
+def best_path(m: models.ProblemSpaceMap) -> set[int]:
+    """
+    States on the shortest (by number of transitions) path from the initial state to the state closest to the goal.
+    """
+    if not m.states:
+        return set()
+    target = min(m.states, key=lambda state: state.distance_to_goal).id
+
+    parents: dict[int, int] = {0: 0}
+    queue = collections.deque([0])
+    adjacency = collections.defaultdict(list)
+    for transition in m.transition_history:
+        adjacency[transition.from_state_id].append(transition.to_state_id)
+    while queue and target not in parents:
+        state_id = queue.popleft()
+        for to_state_id in adjacency[state_id]:
+            if to_state_id not in parents:
+                parents[to_state_id] = state_id
+                queue.append(to_state_id)
+
+    if target not in parents:
+        return {0, target}
+
+    path = {target}
+    while target != 0:
+        target = parents[target]
+        path.add(target)
+    return path
+
+
+def top_k_states(m: models.ProblemSpaceMap, k: int) -> set[int]:
+    """
+    Initial state and `k` states with the lowest distance to goal.
+    """
+    states = sorted(m.states, key=lambda state: state.distance_to_goal)[:k]
+    return {0} | {state.id for state in states}
+
+
+def build_graph(
+    m: models.ProblemSpaceMap,
+    name: str = 'problem_space',
+    prune: typing.Literal['none', 'best-path', 'top-k'] = 'none',
+    top_k: int = 10,
+    collapse: bool = True,
+) -> graphviz.Digraph:
+    """
+    With `collapse` repeated transitions between the same states with the same operator become one edge
+    labeled with its count and the step numbers; edge width grows with the count.
+    """
+    if prune == 'best-path':
+        keep = best_path(m)
+    elif prune == 'top-k':
+        keep = top_k_states(m, top_k)
+    else:
+        keep = {state.id for state in m.states}
+
+    g = graphviz.Digraph(name, strict=False)
+
+    for state in m.states:
+        if state.id in keep:
+            g.node(str(state.id), str(state))
+
+    edges: dict[tuple[int, int, int], list[int]] = collections.defaultdict(list)
+    for i, transition in enumerate(m.transition_history):
+        if transition.from_state_id not in keep or transition.to_state_id not in keep:
+            continue
+        if collapse:
+            key = (transition.from_state_id, transition.to_state_id, transition.operator_id)
+        else:
+            key = (transition.from_state_id, transition.to_state_id, i)
+        edges[key].append(i)
+
+    for (from_state_id, to_state_id, _), steps in edges.items():
+        transition = m.transition_history[steps[0]]
+        operator = m.operators[transition.operator_id]
+        if len(steps) == 1:
+            g.edge(str(from_state_id), str(to_state_id), f"#{steps[0]+1} (is_new?: {transition.is_new}): {operator}")
+        else:
+            g.edge(
+                str(from_state_id),
+                str(to_state_id),
+                f"x{len(steps)} #{','.join(str(step+1) for step in steps)}: {operator}",
+                penwidth=str(min(1 + len(steps) / 2, 8)),
+            )
+
+    return g
+
+
+def render(
+    m: models.ProblemSpaceMap,
+    name: str,
+    directory: str = './graphs/',
+    format: str = 'svg',
+    prune: typing.Literal['none', 'best-path', 'top-k'] = 'none',
+    top_k: int = 10,
+    collapse: bool = True,
+) -> str:
+    """
+    Renders without opening a viewer, safe to call from worker processes.
+    RETURNS: path to the rendered file.
+    """
+    g = build_graph(m, name=name, prune=prune, top_k=top_k, collapse=collapse)
+    return g.render(directory=directory, format=format, view=False, cleanup=True)
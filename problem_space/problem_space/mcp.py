@@ -4,14 +4,30 @@ import fastmcp
 from pydantic import Field
 import sympy
 
+from problem_space import metrics
+
 from . import models, registry
 
 mcp = fastmcp.FastMCP(name="Problem Space Map")
 
 REGISTRY = registry.ProblemSpaceRegistry()
 
+metrics.METRICS.gauge(
+    'problem_space_map_size',
+    'Number of objects in the problem-space map',
+    lambda: {
+        ('states',): len(REGISTRY.states),
+        ('operators',): len(REGISTRY.operators),
+        ('transitions',): len(REGISTRY.transition_history),
+        ('snapshots',): len(REGISTRY.snapshots),
+        ('cached_distances',): len(REGISTRY.distance_cache),
+    },
+    ('kind',),
+)
+
 
 @mcp.tool()
+@metrics.instrument
 def start_solving_problem(
     task_description: Annotated[str, Field(description="Full task description with success criteria and complete set of constraints (RULES). May be long, should be self-sufficient and describe set of task rules. You MUST NOT reference external rules here, inine full rule definitions. This is CRUCIAL for correct distance estimation. The distance is estimated based on this parameter")],
 ) -> None:
@@ -37,6 +53,7 @@ def start_solving_problem(
 
 
 @mcp.tool()
+@metrics.instrument
 def add_operator(
     description: Annotated[str, Field(description="Concise operator meaning. MUST contain a verb")],
     complexity: Annotated[int, Field(description="Measure of how this operator would complicate the answer")]
@@ -75,6 +92,7 @@ def add_operator(
 
 
 @mcp.tool()
+@metrics.instrument
 def add_transition(
     from_state_id: Annotated[int, Field(description="ID of state from ProblemSpaceMap which should be previously created with `add_transition` or 0")],
     operator_id: Annotated[int, Field(description="ID of operator from ProblemSpaceMap which should be previously created with `add_operator`")],
@@ -118,6 +136,7 @@ def add_transition(
 
 
 @mcp.tool()
+@metrics.instrument
 def get_insight() -> models.ProblemSpaceMap:
     """
     Get Map of your task progress with distances to goals. Carefully analyze the `ProblemSpaceMap` returned by the tool.
@@ -146,5 +165,65 @@ def get_insight() -> models.ProblemSpaceMap:
     return REGISTRY.get_map()
 
 
+@mcp.tool()
+@metrics.instrument
+def get_evaluator_usage() -> models.EvaluatorUsage:
+    """
+    Tokens and time spent by the distance evaluator. Used by experiment budgets, hidden from solvers.
+    """
+    return REGISTRY.evaluator_usage
+
+
+@metrics.instrument
+def create_snapshot() -> models.SnapshotCreated:
+    """
+    Save the current problem-space map to return to it later with `restore_snapshot`.
+
+    Useful to:
+    - mark a promising state before exploring a risky direction.
+
+    RETURNS: snapshot ID. You can further use this snapshot ID in `restore_snapshot`
+
+    EXAMPLES:
+    - args: {}
+      returns: {"id": 0, "num_states": 5, "num_transitions": 7}
+
+    ERRORS:
+    - goal is not set, this method is called before `start_solving_problem`
+    """
+    snapshot = REGISTRY.snapshot()
+    return models.SnapshotCreated(
+        id=snapshot.id,
+        num_states=len(snapshot.states),
+        num_transitions=len(snapshot.transition_history),
+    )
+
+
+@metrics.instrument
+def restore_snapshot(
+    snapshot_id: Annotated[int, Field(description="ID of snapshot returned from `create_snapshot`")],
+) -> None:
+    """
+    Continue from a problem-space map saved with `create_snapshot`. States, operators and transitions added after the snapshot are dropped from the map, all distances are kept.
+    Create a snapshot first if you may want to come back to the current map.
+
+    Useful when:
+    - the direction explored since the snapshot turned out to be a dead end.
+
+    ERRORS:
+    - snapshot_id does not exist
+    """
+    REGISTRY.checkout(REGISTRY.get_snapshot(snapshot_id))
+
+
+def enable_snapshots() -> None:
+    """
+    Registers `create_snapshot` and `restore_snapshot` tools.
+    Off by default, so the tool set seen by solvers stays the same as in earlier experiments.
+    """
+    mcp.tool()(create_snapshot)
+    mcp.tool()(restore_snapshot)
+
+
 if __name__ == "__main__":
     mcp.run()
@@ -37,3 +37,16 @@ class StateAdded(BaseModel):
 
 class OperatorAdded(BaseModel):
     id: int = Field(description="Operator unique ID")
+
+
+class EvaluatorUsage(BaseModel):
+    calls: int = Field(description="Number of LLM distance evaluations")
+    prompt_tokens: int = Field(description="Prompt tokens processed by the distance evaluator")
+    completion_tokens: int = Field(description="Tokens generated by the distance evaluator")
+    seconds: float = Field(description="Wall-clock time spent in the distance evaluator")
+
+
+class SnapshotCreated(BaseModel):
+    id: int = Field(description="Snapshot unique ID")
+    num_states: int = Field(description="Number of states in the snapshot")
+    num_transitions: int = Field(description="Number of transitions in the snapshot")
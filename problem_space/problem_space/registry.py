@@ -1,9 +1,22 @@
+import collections.abc as cabc
+import time
+import typing
+
 import ollama
 from pydantic import BaseModel
 
+from problem_space import metrics
+
 from . import models
 
 
+T = typing.TypeVar('T')
+
+DISTANCE_EVAL_LATENCY = metrics.METRICS.histogram('problem_space_distance_eval_seconds', 'Latency of LLM distance evaluation')
+DISTANCE_CACHE = metrics.METRICS.counter('problem_space_distance_cache_total', 'Distance cache lookups', ('result',))
+DUPLICATES = metrics.METRICS.counter('problem_space_duplicates_total', 'Rejected duplicate states and operators', ('kind',))
+
+
 DISTANCE_EVAL_INSTRUCTIONS = """INSTRUCTIONS:
 1. Your sole function is to estimate the distance of a 'New state' from a 'Target state'. A lower number (minimum 0) is better. Max distance is 100.
 2. Be very strict at checking RULES provided in goal statement.
@@ -14,34 +27,161 @@ DISTANCE_EVAL_INSTRUCTIONS = """INSTRUCTIONS:
 
 
 
+class Log(typing.Generic[T]):
+    """
+    Append-only list which shares its prefix with the log it was forked from.
+    Forking is O(1); appends to a fork are never visible in the parent and vice versa.
+    """
+
+    def __init__(self, parent: 'Log[T] | None' = None, base: int = 0):
+        self.parent = parent
+        self.base = base
+        self.items: list[T] = []
+
+    def __len__(self) -> int:
+        return self.base + len(self.items)
+
+    def __getitem__(self, i: int) -> T:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        log = self
+        while i < log.base:
+            log = log.parent
+        return log.items[i - log.base]
+
+    def __iter__(self) -> cabc.Iterator[T]:
+        segments = []
+        log, end = self, len(self)
+        while log is not None:
+            segments.append(log.items[:end - log.base])
+            log, end = log.parent, log.base
+        for segment in reversed(segments):
+            yield from segment
+
+    def append(self, item: T) -> None:
+        self.items.append(item)
+
+    def fork(self) -> 'Log[T]':
+        if not self.items and self.parent is not None:
+            # an empty fork adds nothing, branch from its parent to keep chains short
+            return Log(parent=self.parent, base=self.base)
+        return Log(parent=self, base=len(self))
+
+
+class Snapshot:
+    """
+    Immutable versioned view of a problem space.
+    """
+
+    def __init__(
+        self,
+        id: int,
+        goal_description: str,
+        states: Log[models.State],
+        operators: Log[models.Operator],
+        transition_history: Log[models.Transition],
+    ):
+        self.id = id
+        self.goal_description = goal_description
+        self.states = states
+        self.operators = operators
+        self.transition_history = transition_history
+
+    def get_map(self) -> models.ProblemSpaceMap:
+        return models.ProblemSpaceMap(
+            goal_description=self.goal_description,
+            states=list(self.states),
+            operators=list(self.operators),
+            transition_history=list(self.transition_history),
+        )
+
+
 class ProblemSpaceRegistry:
-    def __init__(self):
+    def __init__(
+        self,
+        distance_cache: dict[tuple, float] | None = None,
+        snapshots: list[Snapshot] | None = None,
+        evaluator_usage: models.EvaluatorUsage | None = None,
+    ):
+        # shared between forks, so every distance is evaluated once per session
+        self.distance_cache = {} if distance_cache is None else distance_cache
+        self.snapshots = [] if snapshots is None else snapshots
+        self.evaluator_usage = evaluator_usage if evaluator_usage is not None else models.EvaluatorUsage(
+            calls=0,
+            prompt_tokens=0,
+            completion_tokens=0,
+            seconds=0,
+        )
         self.reset("unknown")
 
     def reset(self, goal: str):
-        if m := getattr(self, 'm', None):
-            if m.goal_description != "unknown":
-                error_message = (
-                    f"Error: Goal is already set an equals to '{m.goal_description}'."
-                    "You are likely exploring in a circle. "
-                    "Suggestion: Get current problem space using `get_insight` call."
-                )
-                raise ValueError(error_message)
+        if getattr(self, 'goal_description', "unknown") != "unknown":
+            error_message = (
+                f"Error: Goal is already set an equals to '{self.goal_description}'."
+                "You are likely exploring in a circle. "
+                "Suggestion: Get current problem space using `get_insight` call."
+            )
+            raise ValueError(error_message)
 
-        self.m = models.ProblemSpaceMap(
-            goal_description=goal,
-            states=[
-                models.State(
-                    id=0,
-                    description="nothing",
-                    distance_to_goal=100,
-                )
-            ],
-            operators=[],
-            transition_history=[],
-        )
+        self.goal_description = goal
+        self.states: Log[models.State] = Log()
+        self.states.append(models.State(
+            id=0,
+            description="nothing",
+            distance_to_goal=100,
+        ))
+        self.operators: Log[models.Operator] = Log()
+        self.transition_history: Log[models.Transition] = Log()
         self.history = []
 
+    def get_view(self, id: int = -1) -> Snapshot:
+        """
+        Frozen view of the current state of the registry, not registered as a snapshot.
+        """
+        return Snapshot(
+            id=id,
+            goal_description=self.goal_description,
+            states=self.states.fork(),
+            operators=self.operators.fork(),
+            transition_history=self.transition_history.fork(),
+        )
+
+    def snapshot(self) -> Snapshot:
+        if self.goal_description == "unknown":
+            raise ValueError("goal is unknown, call `start_solving_problem` first")
+        snapshot = self.get_view(id=len(self.snapshots))
+        self.snapshots.append(snapshot)
+        return snapshot
+
+    def get_snapshot(self, snapshot_id: int) -> Snapshot:
+        if not 0 <= snapshot_id < len(self.snapshots):
+            raise ValueError(f"Snapshot {snapshot_id} not found. Use ID returned from `create_snapshot`")
+        return self.snapshots[snapshot_id]
+
+    def checkout(self, snapshot: Snapshot) -> None:
+        """
+        Continues this registry from `snapshot`. Progress made since then stays available in other snapshots.
+        """
+        self.goal_description = snapshot.goal_description
+        self.states = snapshot.states.fork()
+        self.operators = snapshot.operators.fork()
+        self.transition_history = snapshot.transition_history.fork()
+
+    def fork(self, snapshot: Snapshot | None = None) -> 'ProblemSpaceRegistry':
+        """
+        New registry branching from `snapshot` (current state by default).
+        It shares explored prefix, distance cache, snapshots and evaluator usage with this registry.
+        """
+        registry = ProblemSpaceRegistry(
+            distance_cache=self.distance_cache,
+            snapshots=self.snapshots,
+            evaluator_usage=self.evaluator_usage,
+        )
+        registry.checkout(snapshot or self.get_view())
+        return registry
+
     def _evaluate_distance_with_llm(
         self,
         previous_state: str,
@@ -49,9 +189,15 @@ class ProblemSpaceRegistry:
         operator_description: str,
         new_state: str,
     ) -> float:
-        if self.m.goal_description == "unknown":
+        if self.goal_description == "unknown":
             raise ValueError("goal is unknown, call `start_solving_problem` first")
 
+        key = (self.goal_description, previous_state, previous_distance, operator_description, new_state)
+        if key in self.distance_cache:
+            DISTANCE_CACHE.inc(result='hit')
+            return self.distance_cache[key]
+        DISTANCE_CACHE.inc(result='miss')
+
         class Answer(BaseModel):
             distance: float
 
@@ -63,7 +209,7 @@ class ProblemSpaceRegistry:
             {
                 'role': 'user',
                 'content': f"""Target state:
-"{self.m.goal_description}"
+"{self.goal_description}"
 
 Previous state (previous distance = {previous_distance}):
 "{previous_state}"
@@ -74,24 +220,36 @@ New state (distance = ?):
             },
         ]
 
-        response = ollama.chat(
-            model='cogito:14b',
-            messages=messages,
-            format=Answer.model_json_schema(),
-            options={
-                'temperature': 0.0,
-                'num_predict': 512,
-            },
-        )
-        return Answer.model_validate_json(response.message.content or '').distance
+        start = time.perf_counter()
+        try:
+            response = ollama.chat(
+                model='cogito:14b',
+                messages=messages,
+                format=Answer.model_json_schema(),
+                options={
+                    'temperature': 0.0,
+                    'num_predict': 512,
+                },
+            )
+        finally:
+            seconds = time.perf_counter() - start
+            DISTANCE_EVAL_LATENCY.observe(seconds)
+            self.evaluator_usage.calls += 1
+            self.evaluator_usage.seconds += seconds
+        self.evaluator_usage.prompt_tokens += response.prompt_eval_count or 0
+        self.evaluator_usage.completion_tokens += response.eval_count or 0
+        distance = Answer.model_validate_json(response.message.content or '').distance
+        self.distance_cache[key] = distance
+        return distance
 
     def add_operator(self, description: str, complexity: int) -> models.OperatorAdded:
-        if self.m.goal_description == "unknown":
+        if self.goal_description == "unknown":
             raise ValueError("goal is unknown, call `start_solving_problem` first")
 
-        for operator in self.m.operators:
+        for operator in self.operators:
             if operator.description == description:
                 # return models.OperatorAlreadyExistsError(existing_id=operator.id)
+                DUPLICATES.inc(kind='operator')
 
                 error_message = (
                     f"Error: The operator '{description}' already exists with ID {operator.id}. "
@@ -101,8 +259,8 @@ New state (distance = ?):
 
                 raise ValueError(error_message)
 
-        op_id = len(self.m.operators)
-        self.m.operators.append(models.Operator(
+        op_id = len(self.operators)
+        self.operators.append(models.Operator(
             id=op_id,
             description=description,
             complexity=complexity,
@@ -112,16 +270,16 @@ New state (distance = ?):
         )
 
     def add_transition(self, from_state_id: int, operator_id: int, new_state_description: str) -> models.StateAdded:
-        if self.m.goal_description == "unknown":
+        if self.goal_description == "unknown":
             raise ValueError("goal is unknown, call `start_solving_problem` first")
-        if from_state_id >= len(self.m.states):
+        if from_state_id >= len(self.states):
             raise ValueError(f"Origin state {from_state_id} not found. Use only existing states. First add state with `add_transition` and use ID returned from that function call")
-        if operator_id >= len(self.m.operators):
+        if operator_id >= len(self.operators):
             raise ValueError(f"Operator '{operator_id}' not found. First add operator with `add_operator` and use ID returned from that function call")
 
-        for state in self.m.states:
+        for state in self.states:
             if state.description == new_state_description:
-                self.m.transition_history.append(
+                self.transition_history.append(
                     models.Transition(
                         from_state_id=from_state_id,
                         to_state_id=state.id,
@@ -129,6 +287,7 @@ New state (distance = ?):
                         is_new=False
                     )
                 )
+                DUPLICATES.inc(kind='state')
                 # return models.StateAlreadyExistsError(
                 #     existing_id=state.id,
                 #     distance_to_goal=state.distance_to_goal,
@@ -142,11 +301,11 @@ New state (distance = ?):
                 raise ValueError(error_message)
                 # raise ValueError(f"state with `description`=\"{new_state_description}\" already exists and has ID = {state.id}")
 
-        state_id = len(self.m.states)
+        state_id = len(self.states)
         distance = self._evaluate_distance_with_llm(
-            previous_state=self.m.states[from_state_id].description,
-            previous_distance=self.m.states[from_state_id].distance_to_goal,
-            operator_description=self.m.operators[operator_id].description,
+            previous_state=self.states[from_state_id].description,
+            previous_distance=self.states[from_state_id].distance_to_goal,
+            operator_description=self.operators[operator_id].description,
             new_state=new_state_description,
         )
         state = models.State(
@@ -154,15 +313,15 @@ New state (distance = ?):
             description=new_state_description,
             distance_to_goal=distance,
         )
-        self.m.states.append(state)
+        self.states.append(state)
 
-        self.m.transition_history.append(
+        self.transition_history.append(
             models.Transition(
                 from_state_id=from_state_id,
                 to_state_id=state.id,
                 operator_id=operator_id,
                 is_new=True
-                # distance_delta=state.distance_to_goal-self.m.states[from_state_id].distance_to_goal,
+                # distance_delta=state.distance_to_goal-self.states[from_state_id].distance_to_goal,
             )
         )
         return models.StateAdded(
@@ -171,6 +330,6 @@ New state (distance = ?):
         )
 
     def get_map(self) -> models.ProblemSpaceMap:
-        if self.m.goal_description == "unknown":
+        if self.goal_description == "unknown":
             raise ValueError("goal is unknown, call `start_solving_problem` first")
-        return self.m
+        return self.get_view().get_map()
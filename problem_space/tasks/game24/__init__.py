@@ -2,7 +2,8 @@ import collections.abc as cabc
 import re
 import os
 import sympy
-import pandas as pd
+
+from problem_space.tasks import sources
 
 
 # 5-shot
@@ -32,9 +33,23 @@ Input: {input}
 '''
 
 
+DIFFICULTY_COLUMNS = ('Rank', 'Solved rate', 'AMT (s)')
+
+
 class Task:
-    def __init__(self, input: str):
+    def __init__(self, input: str, index: int = 0, meta: dict[str, str] | None = None):
         self.input = input
+        self.index = index
+        self.meta = meta or {}
+
+    def get_difficulty(self, column: str = 'Rank') -> float:
+        """
+        Higher is harder. `Solved rate` is inverted to keep this order.
+        """
+        value = sources.parse_number(self.meta[column])
+        if column == 'Solved rate':
+            return -value
+        return value
 
     def get_prompt(self) -> str:
         return STANDARD_PROMPT.format(input=self.input)
@@ -52,8 +67,12 @@ class Task:
 
 
 
-def iter_tasks() -> cabc.Iterator[Task]:
-    module_dir = os.path.dirname(__file__)
-    data_path = os.path.join(module_dir, 'data.csv')
-    for input in pd.read_csv(data_path)['Puzzles']:
-        yield Task(input)
+def iter_tasks(data_path: str | None = None) -> cabc.Iterator[Task]:
+    """
+    Streams tasks from a `.csv` or `.jsonl` source with a `Puzzles` column, `data.csv` by default.
+    """
+    if data_path is None:
+        module_dir = os.path.dirname(__file__)
+        data_path = os.path.join(module_dir, 'data.csv')
+    for index, row in enumerate(sources.iter_rows(data_path)):
+        yield Task(row['Puzzles'], index=index, meta=row)
@@ -0,0 +1,83 @@
+import collections.abc as cabc
+import csv
+import json
+import os
+import typing
+
+
+T = typing.TypeVar('T')
+
+
+def iter_csv(path: str) -> cabc.Iterator[dict[str, str]]:
+    with open(path, newline='') as f:
+        yield from csv.DictReader(f)
+
+
+def iter_jsonl(path: str) -> cabc.Iterator[dict[str, typing.Any]]:
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_rows(path: str) -> cabc.Iterator[dict[str, typing.Any]]:
+    """
+    Streams rows of a `.csv` or `.jsonl` file without loading the whole file.
+    """
+    _, ext = os.path.splitext(path)
+    if ext == '.csv':
+        return iter_csv(path)
+    if ext in ('.jsonl', '.ndjson'):
+        return iter_jsonl(path)
+    raise ValueError(f"unsupported task source format '{ext}', expected .csv or .jsonl")
+
+
+def parse_number(value: typing.Any) -> float:
+    """
+    Parses difficulty columns like `Rank` ("12"), `Solved rate` ("99.20%") or `AMT (s)` ("4.4").
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = str(value).strip()
+    if value.endswith('%'):
+        return float(value[:-1]) / 100
+    return float(value)
+
+
+def parse_shard(shard: str) -> tuple[int, int]:
+    """
+    Parses `k/N` where 1 <= k <= N.
+    """
+    try:
+        k, n = (int(part) for part in shard.split('/'))
+    except ValueError:
+        raise ValueError(f"shard '{shard}' should be formatted as k/N, e.g. 1/4")
+    if n < 1 or not 1 <= k <= n:
+        raise ValueError(f"shard '{shard}' is out of range, expected 1 <= k <= N")
+    return k, n
+
+
+def shard(
+    items: cabc.Iterable[T],
+    k: int,
+    n: int,
+    key: cabc.Callable[[T], float] | None = None,
+) -> cabc.Iterator[T]:
+    """
+    Deterministically takes the `k`-th of `n` shards (1-based), preserving the order of `items`.
+
+    Items are dealt round-robin, so shards differ in size by at most one.
+    With `key` items are first ordered by it (e.g. difficulty) and then dealt, so every shard
+    gets an even share of each difficulty level. This needs to read all items first.
+    """
+    if key is None:
+        for position, item in enumerate(items):
+            if position % n == k - 1:
+                yield item
+        return
+
+    items = list(items)
+    order = sorted(range(len(items)), key=lambda position: (key(items[position]), position))
+    selected = sorted(order[k - 1::n])
+    for position in selected:
+        yield items[position]
@@ -4,10 +4,13 @@ import fastmcp
 from pydantic import Field
 import sympy
 
+from problem_space import metrics
+
 mcp = fastmcp.FastMCP(name="Calculator")
 
 
 @mcp.tool()
+@metrics.instrument
 def evaluate_expression(
     expression: Annotated[str, Field(description="Expression you want to evaluate")],
 ) -> float:
@@ -25,3 +28,4 @@ def evaluate_expression(
         return sympy.simplify(sympy.parse_expr(expression))
     except sympy.SympifyError as err:
         raise Exception(str(err) + ": " + err.expr)
+
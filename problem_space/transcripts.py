@@ -0,0 +1,382 @@
+import collections
+import collections.abc as cabc
+import hashlib
+import json
+import os
+import re
+import typing
+import zlib
+
+
+OBJECTS_FILE = 'objects.bin'
+OBJECTS_INDEX_FILE = 'objects.idx'
+RECORDS_FILE = 'records.jsonl'
+RECORDS_INDEX_FILE = 'records.idx'
+ZDICT_FILE = 'zdict.bin'
+
+# chunks end after a newline or after an object in a JSON list, so prompts share their lines
+# and growing `get_insight` dumps share their states, operators and transitions
+CHUNK_BOUNDARY = re.compile(r'(?<=\n)|(?<=\},)')
+
+# decompressed blocks kept in memory, consecutive messages of a record live in one block
+BLOCK_CACHE_SIZE = 16
+
+
+def object_hash(payload: str) -> str:
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def split_chunks(content: str) -> list[str]:
+    return [chunk for chunk in CHUNK_BOUNDARY.split(content) if chunk]
+
+
+class Record(cabc.Mapping):
+    """
+    Experiment record which reconstructs its `chat` from the store only when it is accessed.
+    """
+
+    def __init__(self, store: 'TranscriptStore', fields: dict):
+        self._store = store
+        self._fields = fields
+        self._chat = None
+
+    @property
+    def chat(self) -> list[dict]:
+        if self._chat is None:
+            self._chat = [self._store.get_message(message_id) for message_id in self._fields['chat']]
+        return self._chat
+
+    def __getitem__(self, key: str) -> typing.Any:
+        if key == 'chat':
+            return self.chat
+        return self._fields[key]
+
+    def __iter__(self) -> cabc.Iterator[str]:
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def to_dict(self) -> dict:
+        return {**self._fields, 'chat': self.chat}
+
+
+class TranscriptStore:
+    """
+    Content-addressed storage for `run_experiment` records.
+
+    Message contents are split into chunks (lines, objects of JSON lists) and every distinct chunk
+    is stored once, so repeated prompts and the growing `get_insight` dumps cost only their new parts.
+    Messages are stored as skeletons referencing chunks by integer ID, records reference messages.
+    New objects of a record are compressed together as one zlib block with a preset dictionary
+    (e.g. seeded with the prompts), so they share compression context.
+    An index maps (i, p, method) to record offsets for random access.
+
+    Layout of the store directory:
+    - `zdict.bin`: preset zlib dictionary fixed when the store is created
+    - `objects.bin`: concatenated compressed blocks, each a JSON list of strings
+    - `objects.idx`: JSON lines {"offset", "size", "count"} per block, objects are numbered in order
+    - `records.jsonl`: JSON lines of records with `chat` replaced by a list of message IDs
+    - `records.idx`: JSON lines {"i", "p", "method", "offset"}, a record is visible once indexed
+    """
+
+    def __init__(
+        self,
+        path: str,
+        compression_level: int = 9,
+        zdict: bytes | None = None,
+        read_only: bool = False,
+    ):
+        """
+        Creates the store unless `read_only`, which requires an existing store and never writes to `path`.
+        """
+        self.path = path
+        self.compression_level = compression_level
+        self.read_only = read_only
+        if read_only:
+            if not os.path.exists(os.path.join(path, RECORDS_INDEX_FILE)):
+                raise FileNotFoundError(f"'{path}' is not a transcript store: {RECORDS_INDEX_FILE} is missing")
+        else:
+            os.makedirs(path, exist_ok=True)
+            # an entry cut by a crash would swallow the next appended one
+            for name in (OBJECTS_INDEX_FILE, RECORDS_INDEX_FILE):
+                self._truncate_partial_line(name)
+
+        zdict_path = os.path.join(path, ZDICT_FILE)
+        if os.path.exists(zdict_path):
+            with open(zdict_path, 'rb') as f:
+                zdict = f.read()
+        elif zdict and not read_only:
+            with open(zdict_path, 'wb') as f:
+                f.write(zdict)
+        self.zdict = zdict or None
+
+        self.object_locations: list[tuple[int, int, int]] = []
+        for entry in self._read_index(OBJECTS_INDEX_FILE):
+            for pos in range(entry['count']):
+                self.object_locations.append((entry['offset'], entry['size'], pos))
+        # hashes are needed only for writing, see `_get_object_ids`
+        self._object_ids: dict[str, int] | None = None
+
+        self.record_offsets: list[int] = []
+        self.records: dict[tuple[int, int, str], list[int]] = {}
+        for entry in self._read_index(RECORDS_INDEX_FILE):
+            self.record_offsets.append(entry['offset'])
+            self.records.setdefault((entry['i'], entry['p'], entry['method']), []).append(entry['offset'])
+
+        self._blocks: collections.OrderedDict[int, list[str]] = collections.OrderedDict()
+
+        if read_only:
+            self._objects_file = open(os.path.join(path, OBJECTS_FILE), 'rb')
+            self._records_file = open(os.path.join(path, RECORDS_FILE), 'rb')
+            self._index_files = []
+        else:
+            self._objects_file = open(os.path.join(path, OBJECTS_FILE), 'a+b')
+            self._records_file = open(os.path.join(path, RECORDS_FILE), 'a+b')
+            self._objects_index_file = open(os.path.join(path, OBJECTS_INDEX_FILE), 'a')
+            self._records_index_file = open(os.path.join(path, RECORDS_INDEX_FILE), 'a')
+            self._index_files = [self._objects_index_file, self._records_index_file]
+
+    def __enter__(self) -> 'TranscriptStore':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for f in (self._objects_file, self._records_file, *self._index_files):
+            f.close()
+
+    def _truncate_partial_line(self, name: str) -> None:
+        index_path = os.path.join(self.path, name)
+        if not os.path.exists(index_path):
+            return
+        with open(index_path, 'r+b') as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def _read_index(self, name: str) -> cabc.Iterator[dict]:
+        index_path = os.path.join(self.path, name)
+        if not os.path.exists(index_path):
+            return
+        with open(index_path) as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    # cut by a crash, the entry was never completed
+                    break
+                if line.strip():
+                    yield json.loads(line)
+
+    @property
+    def num_objects(self) -> int:
+        return len(self.object_locations)
+
+    def _append(self, f: typing.BinaryIO, data: bytes) -> int:
+        f.seek(0, os.SEEK_END)
+        offset = f.tell()
+        f.write(data)
+        return offset
+
+    def _read_block(self, offset: int, size: int) -> list[str]:
+        if offset in self._blocks:
+            self._blocks.move_to_end(offset)
+            return self._blocks[offset]
+
+        self._objects_file.seek(offset)
+        data = self._objects_file.read(size)
+        decompressor = zlib.decompressobj(zdict=self.zdict) if self.zdict else zlib.decompressobj()
+        block = json.loads(decompressor.decompress(data) + decompressor.flush())
+
+        self._blocks[offset] = block
+        if len(self._blocks) > BLOCK_CACHE_SIZE:
+            self._blocks.popitem(last=False)
+        return block
+
+    def _get_object_ids(self) -> dict[str, int]:
+        if self._object_ids is None:
+            self._object_ids = {}
+            for object_id, (offset, size, pos) in enumerate(self.object_locations):
+                self._object_ids[object_hash(self._read_block(offset, size)[pos])] = object_id
+        return self._object_ids
+
+    def get_object(self, object_id: int) -> str:
+        offset, size, pos = self.object_locations[object_id]
+        return self._read_block(offset, size)[pos]
+
+    def get_message(self, message_id: int) -> dict:
+        skeleton = json.loads(self.get_object(message_id))
+        message = skeleton['m']
+        if 'c' in skeleton:
+            message['content'] = ''.join(self.get_object(chunk_id) for chunk_id in skeleton['c'])
+        return message
+
+    def add(self, record: cabc.Mapping) -> None:
+        if self.read_only:
+            raise ValueError(f"transcript store '{self.path}' is opened read-only")
+
+        pending: list[str] = []
+        pending_ids: dict[str, int] = {}
+        object_ids = self._get_object_ids()
+
+        def intern(payload: str) -> int:
+            h = object_hash(payload)
+            if h in object_ids:
+                return object_ids[h]
+            if h not in pending_ids:
+                pending_ids[h] = len(self.object_locations) + len(pending)
+                pending.append(payload)
+            return pending_ids[h]
+
+        def add_message(message: dict) -> int:
+            content = message.get('content')
+            if isinstance(content, str):
+                skeleton = {
+                    'm': {key: value for key, value in message.items() if key != 'content'},
+                    'c': [intern(chunk) for chunk in split_chunks(content)],
+                }
+            else:
+                skeleton = {'m': message}
+            return intern(json.dumps(skeleton, sort_keys=True, separators=(',', ':')))
+
+        fields = dict(record)
+        fields['chat'] = [add_message(message) for message in record.get('chat') or []]
+
+        # objects are indexed before the record referencing them, and a record is visible
+        # only once indexed, so a crash never leaves dangling references
+        if pending:
+            compressor = (
+                zlib.compressobj(self.compression_level, zdict=self.zdict)
+                if self.zdict else zlib.compressobj(self.compression_level)
+            )
+            data = compressor.compress(json.dumps(pending).encode()) + compressor.flush()
+            offset = self._append(self._objects_file, data)
+            self._objects_file.flush()
+            for pos, h in enumerate(pending_ids):
+                object_ids[h] = len(self.object_locations)
+                self.object_locations.append((offset, len(data), pos))
+            self._objects_index_file.write(json.dumps({'offset': offset, 'size': len(data), 'count': len(pending)}) + "\n")
+            self._objects_index_file.flush()
+
+        offset = self._append(self._records_file, (json.dumps(fields) + "\n").encode())
+        self._records_file.flush()
+        self._records_index_file.write(json.dumps({
+            'i': fields['i'],
+            'p': fields['p'],
+            'method': fields['method'],
+            'offset': offset,
+        }) + "\n")
+        self._records_index_file.flush()
+        self.record_offsets.append(offset)
+        self.records.setdefault((fields['i'], fields['p'], fields['method']), []).append(offset)
+
+    def read_record(self, offset: int) -> Record:
+        self._records_file.seek(offset)
+        return Record(self, json.loads(self._records_file.readline()))
+
+    def get(self, i: int, p: int, method: str) -> Record:
+        """
+        RETURNS: the latest record stored for (i, p, method).
+        """
+        offsets = self.records.get((i, p, method))
+        if not offsets:
+            raise KeyError((i, p, method))
+        return self.read_record(offsets[-1])
+
+    def get_all(self, i: int, p: int, method: str) -> list[Record]:
+        return [self.read_record(offset) for offset in self.records.get((i, p, method), [])]
+
+    def iter_offsets(self) -> cabc.Iterator[tuple[int, Record]]:
+        for offset in list(self.record_offsets):
+            yield offset, self.read_record(offset)
+
+    def __iter__(self) -> cabc.Iterator[Record]:
+        """
+        Records indexed when the iteration started, in insertion order. Chats are not decompressed until accessed.
+        Other reads and writes of the store are allowed while iterating.
+        """
+        for offset in list(self.record_offsets):
+            yield self.read_record(offset)
+
+    def __len__(self) -> int:
+        return len(self.record_offsets)
+
+
+def iter_output_offsets(lines: cabc.Iterable[bytes | str]) -> cabc.Iterator[tuple[int, dict]]:
+    """
+    Records of a plain `run_experiment` output file with offsets of their lines.
+    Header lines are attached to the following records as `run`.
+    """
+    run = None
+    offset = 0
+    for line in lines:
+        line_offset, offset = offset, offset + len(line)
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            if line.strip():
+                run = (line.decode() if isinstance(line, bytes) else line).strip()
+            continue
+        if not isinstance(record, dict):
+            continue
+        if run is not None:
+            record.setdefault('run', run)
+        yield line_offset, record
+
+
+def iter_output_records(input: typing.IO) -> cabc.Iterator[dict]:
+    """
+    Records from a plain `run_experiment` output file. Header lines are attached to the following records as `run`.
+    """
+    for _, record in iter_output_offsets(input):
+        yield record
+
+
+class OutputFile:
+    """
+    Random access to records of a plain `run_experiment` output file.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+
+    def __enter__(self) -> 'OutputFile':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def iter_offsets(self) -> cabc.Iterator[tuple[int, dict]]:
+        """
+        Records with their byte offsets. Header lines are attached to the following records as `run`.
+        """
+        self._file.seek(0)
+        yield from iter_output_offsets(self._file)
+
+    def read_record(self, offset: int) -> dict:
+        self._file.seek(offset)
+        return json.loads(self._file.readline())
+
+
+def open_records(path: str) -> TranscriptStore | OutputFile:
+    """
+    Opens either a `TranscriptStore` directory or a plain `run_experiment` output file for random access.
+    """
+    if os.path.isdir(path):
+        return TranscriptStore(path, read_only=True)
+    return OutputFile(path)
+
+
+def iter_records(path: str) -> cabc.Iterator[cabc.Mapping]:
+    """
+    Records from either a `TranscriptStore` directory or a plain `run_experiment` output file.
+    """
+    if os.path.isdir(path):
+        with TranscriptStore(path, read_only=True) as store:
+            yield from store
+    else:
+        with open(path) as f:
+            yield from iter_output_records(f)
@@ -1,16 +1,21 @@
+import concurrent.futures
 import json
 import itertools
+import os
 import sys
 import typing
 
 import asyncclick as click
 import fastmcp
-import graphviz
 
 from problem_space.tasks import game24
 from problem_space.methods import iterative, cot
 
 
+# seeds compression of transcript stores with text repeated in every chat
+TRANSCRIPT_ZDICT = (iterative.INSTRUCTIONS_PROMPT + cot.INSTRUCTIONS_PROMPT + game24.STANDARD_PROMPT).encode()
+
+
 @click.group()
 async def cli():
     pass
@@ -21,22 +26,75 @@ async def cli():
 @click.option('--temperature', type=float, default=0.1)
 @click.option('--task-idx-from', type=int, default=0)
 @click.option('--num-tasks', type=int, default=20)
+@click.option('--tasks', 'tasks_path', type=click.Path(exists=True, dir_okay=False), default=None, help="Task source (.csv or .jsonl), game24 data.csv by default")
+@click.option('--shard', type=str, default=None, help="Run only the k-th of N shards of the selected tasks, e.g. 1/4")
+@click.option('--stratify-by', type=click.Choice(game24.DIFFICULTY_COLUMNS), default=None, help="Balance shards by this difficulty column")
+@click.option('--order-by', type=click.Choice(game24.DIFFICULTY_COLUMNS), default=None, help="Run easiest tasks by this difficulty column first")
+@click.option('--attempts', type=int, default=3, help="Attempts per task and method")
+@click.option('--iterative-max-iter', type=int, default=50)
+@click.option('--cot-max-iter', type=int, default=3)
+@click.option('--token-budget', type=int, default=None, help="Max prompt + completion tokens per attempt, including distance evaluations")
+@click.option('--time-budget', type=float, default=None, help="Soft limit of wall-clock seconds per attempt, checked while streaming and before every tool call")
+@click.option('--halt-policy', type=click.Choice(['none', 'pass-at-k']), default='none', help="pass-at-k: skip remaining attempts of a method once it solved the task")
+@click.option('--rerun-budget', type=int, default=0, help="Extra attempts per method for tasks it left unsolved, stopping at first success")
+@click.option('--snapshot-tools/--no-snapshot-tools', default=False, help="Give the solver create_snapshot/restore_snapshot tools")
 @click.option('--output', type=click.File(mode="a"), default="output.json")
+@click.option('--store', type=click.Path(file_okay=False), default=None, help="Write records to a transcript store directory instead of --output")
 async def run_experiment(
     model: str,
     temperature: float,
     task_idx_from: int,
     num_tasks: int,
+    tasks_path: str | None,
+    shard: str | None,
+    stratify_by: str | None,
+    order_by: str | None,
+    attempts: int,
+    iterative_max_iter: int,
+    cot_max_iter: int,
+    token_budget: int | None,
+    time_budget: float | None,
+    halt_policy: str,
+    rerun_budget: int,
+    snapshot_tools: bool,
     output: typing.IO,
+    store: str | None,
 ):
-    output.write(model+"_"+str(temperature)+"\n")
-    for i, task in itertools.islice(enumerate(game24.iter_tasks()), task_idx_from, task_idx_from + num_tasks):
-        for p in range(3):
+    from problem_space import transcripts
+    from problem_space.methods.budget import Budget
+    from problem_space.tasks import sources
+
+    tasks = itertools.islice(game24.iter_tasks(tasks_path), task_idx_from, task_idx_from + num_tasks)
+    if stratify_by is not None and shard is None:
+        raise click.BadParameter("requires --shard", param_hint='--stratify-by')
+    if shard is not None:
+        try:
+            k, n = sources.parse_shard(shard)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--shard')
+        key = (lambda task: task.get_difficulty(stratify_by)) if stratify_by else None
+        tasks = sources.shard(tasks, k, n, key=key)
+
+    run = model+"_"+str(temperature)
+    transcript_store = transcripts.TranscriptStore(store, zdict=TRANSCRIPT_ZDICT) if store else None
+
+    def write_record(record: dict):
+        if transcript_store is not None:
+            transcript_store.add({**record, 'run': run})
+        else:
+            output.write(json.dumps(record) + "\n")
+
+    if transcript_store is None:
+        output.write(run+"\n")
+
+    async def run_attempt(task: game24.Task, p: int, method: str, stage: str) -> bool:
+        attempt_budget = Budget(max_tokens=token_budget, max_seconds=time_budget)
+        if method == 'problem_space':
             config = {
                 "mcpServers": {
                     "problem_space": {
                         "command": sys.executable,
-                        "args": [__file__, "run-model-mcp"],
+                        "args": [__file__, "run-model-mcp", *(["--snapshots"] if snapshot_tools else [])],
                         "env": {},
                     },
                     "calculator": {
@@ -54,67 +112,214 @@ async def run_experiment(
                     task,
                     model=model,
                     temperature=temperature,
-                    max_iter=50,
+                    max_iter=iterative_max_iter,
+                    budget=attempt_budget,
                 )
-
-            is_solved = task.validate(answer)
-            print("IS_SOLVED:", is_solved)
-            output.write(json.dumps({
-                'i': i,
-                'p': p,
-                'method': 'problem_space',
-                'task': task.input,
-                'answer': answer,
-                'is_solved': int(is_solved),
-                'chat': messages,
-            }) + "\n")
-
+        else:
             answer, messages = await cot.run(
                 task,
                 model=model,
                 temperature=0.3,
-                max_iter=3,
+                max_iter=cot_max_iter,
+                budget=attempt_budget,
             )
 
-            is_solved = task.validate(answer)
-            print("IS_SOLVED:", is_solved)
-            output.write(json.dumps({
-                'i': i,
-                'p': p,
-                'method': 'cot',
-                'task': task.input,
-                'answer': answer,
-                'is_solved': int(is_solved),
-                'chat': messages,
-            }) + "\n")
+        is_solved = task.validate(answer)
+        print("IS_SOLVED:", is_solved)
+        write_record({
+            'i': task.index,
+            'p': p,
+            'method': method,
+            'stage': stage,
+            'task': task.input,
+            'answer': answer,
+            'is_solved': int(is_solved),
+            'budget': attempt_budget.to_dict(),
+            'chat': messages,
+        })
+        return is_solved
+
+    try:
+        if order_by is not None:
+            tasks = sorted(tasks, key=lambda task: task.get_difficulty(order_by))
+
+        methods = ('problem_space', 'cot')
+        unresolved = []
+        for task in tasks:
+            solved = {method: False for method in methods}
+            for p in range(attempts):
+                for method in methods:
+                    # pass@k of this method is already decided
+                    if halt_policy == 'pass-at-k' and solved[method]:
+                        continue
+                    solved[method] |= await run_attempt(task, p, method, 'main')
+            unresolved.extend((task, method) for method in methods if not solved[method])
+
+        for task, method in unresolved:
+            for r in range(rerun_budget):
+                if await run_attempt(task, attempts + r, method, 'rerun'):
+                    break
+    finally:
+        if transcript_store is not None:
+            transcript_store.close()
 
 
 @cli.command()
 @click.argument('input', type=click.File(mode='r'), default='-')
-async def show_graph(input: typing.IO):
-    from problem_space.problem_space import models
+@click.option('--prune', type=click.Choice(['none', 'best-path', 'top-k']), default='none')
+@click.option('--top-k', type=int, default=10)
+@click.option('--collapse/--no-collapse', default=False)
+async def show_graph(input: typing.IO, prune: str, top_k: int, collapse: bool):
+    from problem_space.problem_space import graph, models
 
     map = models.ProblemSpaceMap.model_validate_json(input.read())
-    g = graphviz.Digraph('problem_space', strict=False)
+    g = graph.build_graph(map, prune=prune, top_k=top_k, collapse=collapse)
+    g.render(directory="./graphs/", view=True, format="svg")
 
-    for state in map.states:
-        g.node(str(state.id), str(state))
 
-    for i, transition in enumerate(map.transition_history):
-        g.edge(str(transition.from_state_id), str(transition.to_state_id), f"#{i+1} (is_new?: {transition.is_new}): {map.operators[transition.operator_id]}")
+@cli.command()
+@click.argument('input', type=click.Path(exists=True), default='output.json')
+@click.option('--directory', type=str, default='./graphs/')
+@click.option('--format', type=str, default='svg')
+@click.option('--prune', type=click.Choice(['none', 'best-path', 'top-k']), default='none')
+@click.option('--top-k', type=int, default=10)
+@click.option('--collapse/--no-collapse', default=True)
+@click.option('--workers', type=int, default=os.cpu_count() or 1)
+async def show_graphs(
+    input: str,
+    directory: str,
+    format: str,
+    prune: str,
+    top_k: int,
+    collapse: bool,
+    workers: int,
+):
+    from problem_space import transcripts
+    from problem_space.problem_space import graph
 
-    g.render(directory="./graphs/", view=True, format="svg")
+    num_failed = 0
+
+    def report(future: concurrent.futures.Future):
+        nonlocal num_failed
+        i, p = pending.pop(future)
+        try:
+            print(future.result())
+        except Exception as e:
+            num_failed += 1
+            print(f"failed to render map of i={i} p={p}: {type(e).__name__}: {e}")
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending: dict[concurrent.futures.Future, tuple[typing.Any, typing.Any]] = {}
+        for n, (record, map) in enumerate(graph.iter_maps(transcripts.iter_records(input))):
+            name = f"problem_space_{n}_{record.get('i')}_{record.get('p')}"
+            future = executor.submit(
+                graph.render,
+                map,
+                name,
+                directory=directory,
+                format=format,
+                prune=prune,
+                top_k=top_k,
+                collapse=collapse,
+            )
+            pending[future] = (record.get('i'), record.get('p'))
+            # keep a bounded number of maps in flight
+            if len(pending) >= 2 * workers:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    report(future)
+
+        for future in concurrent.futures.as_completed(list(pending)):
+            report(future)
+
+    if num_failed:
+        print(f"{num_failed} maps failed to render")
 
 
 @cli.command()
-async def run_model_mcp():
-    from problem_space.problem_space.mcp import mcp
+@click.argument('input', type=click.File(mode='r'), default='output.json')
+@click.argument('store', type=click.Path(file_okay=False))
+async def pack_output(input: typing.IO, store: str):
+    """
+    Converts plain `run_experiment` output into a transcript store.
+    """
+    from problem_space import transcripts
+
+    with transcripts.TranscriptStore(store, zdict=TRANSCRIPT_ZDICT) as transcript_store:
+        for record in transcripts.iter_output_records(input):
+            transcript_store.add(record)
+        print(f"{len(transcript_store)} records, {transcript_store.num_objects} unique objects")
+
+
+@cli.command()
+@click.argument('inputs', type=click.Path(exists=True), nargs=-1, required=True)
+@click.option('--output', type=click.File(mode="w"), default=None, help="Plain output file to write merged records to")
+@click.option('--store', type=click.Path(file_okay=False), default=None, help="Write merged records to a transcript store directory instead of --output")
+async def merge_outputs(inputs: tuple[str, ...], output: typing.IO | None, store: str | None):
+    """
+    Merges shard outputs (plain files or transcript stores) ordered by run and task.
+    Records repeated across inputs for the same (run, i, p, method) are kept once.
+    Only record offsets are kept in memory, records are streamed one by one.
+    """
+    from problem_space import transcripts
+
+    if (output is None) == (store is None):
+        raise click.UsageError("exactly one of --output or --store is required")
+
+    sources = [transcripts.open_records(input) for input in inputs]
+    try:
+        locations = {}
+        for n, source in enumerate(sources):
+            for offset, record in source.iter_offsets():
+                key = (record.get('run') or '', record['i'], record['p'], record['method'])
+                locations.setdefault(key, (n, offset))
+
+        def iter_merged() -> typing.Iterator[tuple[str, typing.Mapping]]:
+            for key in sorted(locations):
+                n, offset = locations[key]
+                yield key[0], sources[n].read_record(offset)
+
+        if store is not None:
+            with transcripts.TranscriptStore(store, zdict=TRANSCRIPT_ZDICT) as transcript_store:
+                for run, record in iter_merged():
+                    transcript_store.add({**record, 'run': run} if run else record)
+        else:
+            current_run = None
+            for run, record in iter_merged():
+                record = dict(record)
+                record.pop('run', None)
+                if run != current_run:
+                    current_run = run
+                    output.write(run+"\n")
+                output.write(json.dumps(record) + "\n")
+    finally:
+        for source in sources:
+            source.close()
+    print(f"merged {len(locations)} records from {len(inputs)} inputs")
+
+
+@cli.command()
+@click.option('--metrics-port', type=int, default=None, help="Serve Prometheus metrics on this port and add the get_server_stats tool")
+@click.option('--snapshots/--no-snapshots', default=False, help="Add create_snapshot/restore_snapshot tools")
+async def run_model_mcp(metrics_port: int | None, snapshots: bool):
+    from problem_space import metrics
+    from problem_space.problem_space.mcp import enable_snapshots, mcp
+
+    if snapshots:
+        enable_snapshots()
+    if metrics_port is not None:
+        metrics.enable(mcp, metrics_port)
     await mcp.run_async()
 
 
 @cli.command()
-async def run_calculator_mcp():
+@click.option('--metrics-port', type=int, default=None, help="Serve Prometheus metrics on this port and add the get_server_stats tool")
+async def run_calculator_mcp(metrics_port: int | None):
+    from problem_space import metrics
     from problem_space.tools.calculator import mcp
+
+    if metrics_port is not None:
+        metrics.enable(mcp, metrics_port)
     await mcp.run_async()
 
 